@@ -0,0 +1,192 @@
+"""Reading analytics backed by hourly and daily rollup tables.
+
+Each closed reading session is folded into reading_rollup_hourly and reading_rollup_daily
+(per book, per category and per user age band) in the same transaction that closes it,
+so dashboard queries read a few hundred pre-aggregated rows instead of scanning
+reading_sessions. Sessions are attributed to the bucket they started in.
+
+    python analytics.py --rebuild              # recompute rollups from all closed sessions
+    python analytics.py --export sessions.parquet   # columnar export (requires pyarrow)
+
+Both take --db <path>; the default is instance/database.db next to this file.
+"""
+import os
+import sqlite3
+import sys
+import time
+
+HOUR = 3600
+DAY = 86400
+GRAINS = {'hour': ('reading_rollup_hourly', HOUR), 'day': ('reading_rollup_daily', DAY)}
+DIMENSIONS = ('book', 'category', 'age_band')
+# (upper bound exclusive, label)
+AGE_BANDS = ((6, '0-5'), (9, '6-8'), (13, '9-12'), (18, '13-17'), (None, '18+'))
+EXPORT_BATCH = 50000
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'database.db')
+
+
+def age_band(age):
+    if age is None:
+        return 'unknown'
+    for upper, label in AGE_BANDS:
+        if upper is None or age < upper:
+            return label
+    return 'unknown'
+
+
+def _age_band_sql(col):
+    """SQL CASE expression equivalent to age_band() for set-based rebuilds."""
+    parts = []
+    for upper, label in AGE_BANDS:
+        if upper is None:
+            parts.append(f"ELSE '{label}'")
+        else:
+            parts.append(f"WHEN {col} < {upper} THEN '{label}'")
+    return f"CASE WHEN {col} IS NULL THEN 'unknown' {' '.join(parts)} END"
+
+
+def ensure_schema(conn):
+    """Create the rollup tables if they don't exist yet."""
+    cur = conn.cursor()
+    for table, _ in GRAINS.values():
+        # bucket is the epoch second the hour/day starts at (UTC)
+        cur.execute(f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+            dim TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            dim_value TEXT NOT NULL,
+            sessions INTEGER NOT NULL DEFAULT 0,
+            seconds INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (dim, bucket, dim_value)
+        )
+        ''')
+    conn.commit()
+
+
+def record_session(conn, user_id, book_id, started_at, duration):
+    """Fold one closed session into the rollups. Does not commit: call it inside the
+    transaction that closes the session so the rollups never double count."""
+    cur = conn.cursor()
+    row = cur.execute('''
+        SELECT (SELECT category FROM books WHERE id = ?) AS category,
+               (SELECT age FROM users WHERE id = ?) AS age
+    ''', (book_id, user_id)).fetchone()
+    values = {
+        'book': str(book_id),
+        'category': (row[0] if row and row[0] else 'Бусад'),
+        'age_band': age_band(row[1] if row else None),
+    }
+    for table, width in GRAINS.values():
+        bucket = started_at - started_at % width
+        cur.executemany(f'''
+            INSERT INTO {table} (dim, bucket, dim_value, sessions, seconds) VALUES (?, ?, ?, 1, ?)
+            ON CONFLICT(dim, bucket, dim_value) DO UPDATE SET
+                sessions = sessions + 1, seconds = seconds + excluded.seconds
+        ''', [(dim, bucket, values[dim], duration or 0) for dim in DIMENSIONS])
+
+
+def rebuild(conn):
+    """Recompute every rollup from closed reading sessions (set-based, one pass per table)."""
+    ensure_schema(conn)
+    cur = conn.cursor()
+    dim_exprs = {
+        'book': 'CAST(rs.book_id AS TEXT)',
+        'category': "COALESCE(NULLIF(b.category, ''), 'Бусад')",
+        'age_band': _age_band_sql('u.age'),
+    }
+    try:
+        for table, width in GRAINS.values():
+            cur.execute(f'DELETE FROM {table}')
+            for dim, expr in dim_exprs.items():
+                cur.execute(f'''
+                    INSERT INTO {table} (dim, bucket, dim_value, sessions, seconds)
+                    SELECT ?, rs.started_at - rs.started_at % {width}, {expr},
+                           COUNT(*), COALESCE(SUM(rs.duration_seconds), 0)
+                    FROM reading_sessions rs
+                    LEFT JOIN books b ON b.id = rs.book_id
+                    LEFT JOIN users u ON u.id = rs.user_id
+                    WHERE rs.ended_at IS NOT NULL AND rs.started_at IS NOT NULL
+                    GROUP BY 2, 3
+                ''', (dim,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def query(conn, dim, grain='day', days=90, now=None):
+    """Return reading totals for one dimension over the last `days` days.
+
+    Result: {'buckets': [epoch, ...], 'series': {dim_value: {'minutes': [...], 'sessions': [...]}}}
+    with one entry per bucket (zero-filled) so it can be charted directly."""
+    if dim not in DIMENSIONS:
+        raise ValueError(f'unknown dimension: {dim}')
+    if grain not in GRAINS:
+        raise ValueError(f'unknown grain: {grain}')
+    table, width = GRAINS[grain]
+    now = int(now if now is not None else time.time())
+    end = now - now % width
+    start = end - (days * DAY // width - 1) * width
+    rows = conn.execute(f'''
+        SELECT bucket, dim_value, sessions, seconds FROM {table}
+        WHERE dim = ? AND bucket >= ? AND bucket <= ?
+        ORDER BY bucket
+    ''', (dim, start, end)).fetchall()
+    buckets = list(range(start, end + 1, width))
+    index = {b: i for i, b in enumerate(buckets)}
+    series = {}
+    for bucket, value, sessions, seconds in rows:
+        s = series.setdefault(value, {'minutes': [0] * len(buckets), 'sessions': [0] * len(buckets)})
+        i = index[bucket]
+        s['minutes'][i] = round(seconds / 60, 1)
+        s['sessions'][i] = sessions
+    return {'dim': dim, 'grain': grain, 'buckets': buckets, 'series': series}
+
+
+def export_parquet(conn, out, batch_size=EXPORT_BATCH):
+    """Write raw reading sessions (with book category and user age band) to a Parquet file
+    or binary file object, streaming in record batches. Requires pyarrow."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError('Parquet export requires pyarrow (pip install pyarrow)')
+    schema = pa.schema([
+        ('id', pa.int64()), ('user_id', pa.int64()), ('book_id', pa.int64()),
+        ('started_at', pa.timestamp('s')), ('ended_at', pa.timestamp('s')),
+        ('duration_seconds', pa.int64()), ('category', pa.string()), ('age_band', pa.string()),
+    ])
+    cur = conn.execute(f'''
+        SELECT rs.id, rs.user_id, rs.book_id, rs.started_at, rs.ended_at, rs.duration_seconds,
+               COALESCE(NULLIF(b.category, ''), 'Бусад'), {_age_band_sql('u.age')}
+        FROM reading_sessions rs
+        LEFT JOIN books b ON b.id = rs.book_id
+        LEFT JOIN users u ON u.id = rs.user_id
+        ORDER BY rs.id
+    ''')
+    with pq.ParquetWriter(out, schema, compression='zstd') as writer:
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            columns = list(zip(*rows))
+            writer.write_batch(pa.record_batch([pa.array(c, type=f.type) for c, f in zip(columns, schema)], schema=schema))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    db_path = args[args.index('--db') + 1] if '--db' in args and args.index('--db') + 1 < len(args) else DB_PATH
+    if not os.path.exists(db_path):
+        sys.exit(f'{db_path}: no such database')
+    db = sqlite3.connect(db_path)
+    if '--rebuild' in args:
+        started = time.time()
+        rebuild(db)
+        print(f'Rebuilt reading rollups in {time.time() - started:.2f}s')
+    elif '--export' in args and args.index('--export') + 1 < len(args):
+        path = args[args.index('--export') + 1]
+        export_parquet(db, path)
+        print(f'Exported reading sessions to {path}')
+    else:
+        print('usage: python analytics.py [--db <path>] --rebuild | --export <file.parquet>')
+    db.close()
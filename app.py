@@ -1,26 +1,85 @@
+import time
+_import_started = time.perf_counter()
 import os
 import sqlite3
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
-import time
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Flask, Blueprint, current_app, render_template, request, redirect, url_for, session, flash, jsonify, send_file
+from storage import create_storage
+import analytics
+import auth
+import throttle
+import progress
+import thumbnails
+import threading
+from startup import PhaseTimer
 
-app = Flask(__name__, instance_relative_config=True)
-# secret key for session management; in production set via environment
-app.secret_key = os.environ.get('SECRET_KEY', 'dev_secret_key')
 # admin password (can be set via environment ADMIN_PASSWORD)
 # default admin password requested by user
 ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', '0247790208')
-# ensure the instance folder exists (where the sqlite DB will live)
-os.makedirs(app.instance_path, exist_ok=True)
+# bump when a new ensure_*_schema step is added so existing databases get migrated once
+SCHEMA_VERSION = 1
 
+# every route lives on this blueprint; create_app() registers it on a fresh Flask app
+bp = Blueprint('main', __name__)
 
-def get_db_connection():
-    db_path = os.path.join(app.instance_path, 'database.db')
-    conn = sqlite3.connect(db_path)
+
+def _connect(app):
+    conn = sqlite3.connect(app.config['DATABASE'])
     conn.row_factory = sqlite3.Row
     return conn
 
 
+def get_db_connection():
+    return _connect(current_app)
+
+
+_extensions_lock = threading.Lock()
+
+
+def _extension(name, factory):
+    """Return app.extensions[name], building it with factory(app) on first use."""
+    app = current_app._get_current_object()
+    ext = app.extensions.get(name)
+    if ext is None:
+        with _extensions_lock:
+            ext = app.extensions.get(name)
+            if ext is None:
+                with app.extensions['startup'].phase(f'extension: {name}'):
+                    ext = app.extensions[name] = factory(app)
+    return ext
+
+
+def get_storage():
+    """Upload storage backend (covers, pages, profile images); see storage.py."""
+    return _extension('storage', create_storage)
+
+
+def get_progress_buffer():
+    """Positions reported by reader.js, written to reading_progress in periodic batches."""
+    return _extension('progress', lambda app: progress.ProgressBuffer(
+        lambda: _connect(app),
+        interval=float(os.environ.get('PROGRESS_FLUSH_INTERVAL', progress.FLUSH_INTERVAL))))
+
+
+def get_user_cache():
+    """User rows keyed by session user_id; invalidated when a user's record changes."""
+    return _extension('user_cache', lambda app: auth.UserCache())
+
+
+def _load_user(user_id):
+    conn = get_db_connection()
+    row = conn.execute('SELECT id, name, age, image FROM users WHERE id = ?', (user_id,)).fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+
+def get_current_user():
+    """Return the logged-in user's record (id, name, age, image) or None, served from the user cache."""
+    user_id = session.get('user_id')
+    if not user_id:
+        return None
+    return get_user_cache().get(user_id, _load_user)
+
+
 def _reading_table_columns(conn):
     """Return a dict of column info for reading_sessions: name -> {notnull, dflt_value}
     Falls back to an empty dict if the table doesn't exist or PRAGMA fails."""
@@ -43,16 +102,17 @@ def ensure_reading_sessions_schema():
     """Ensure the reading_sessions table has the expected columns (started_at, ended_at, duration_seconds).
     If older columns (start_time, end_time) exist, copy their values into the new columns.
     This makes the app tolerant of older database schemas that used different column names.
+    Returns True once the table is up to date, False if it is missing or the migration failed.
     """
     conn = None
+    ok = True
     try:
         conn = get_db_connection()
         cur = conn.cursor()
         cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='reading_sessions'")
         if cur.fetchone() is None:
-            # no table yet; nothing to migrate here
-            conn.close()
-            return
+            # no table yet (init_db.py hasn't run); try again on the next start
+            return False
         cur.execute("PRAGMA table_info(reading_sessions)")
         existing = [r[1] for r in cur.fetchall()]
 
@@ -61,17 +121,17 @@ def ensure_reading_sessions_schema():
             try:
                 cur.execute('ALTER TABLE reading_sessions ADD COLUMN started_at INTEGER')
             except Exception:
-                pass
+                ok = False
         if 'ended_at' not in existing:
             try:
                 cur.execute('ALTER TABLE reading_sessions ADD COLUMN ended_at INTEGER')
             except Exception:
-                pass
+                ok = False
         if 'duration_seconds' not in existing:
             try:
                 cur.execute('ALTER TABLE reading_sessions ADD COLUMN duration_seconds INTEGER')
             except Exception:
-                pass
+                ok = False
 
         # If older column names exist, copy values across.
         # Use UPDATE ... WHERE ... to avoid overwriting existing migrated values.
@@ -79,20 +139,22 @@ def ensure_reading_sessions_schema():
             try:
                 cur.execute('UPDATE reading_sessions SET started_at = start_time WHERE started_at IS NULL')
             except Exception:
-                pass
+                ok = False
         if 'end_time' in existing:
             try:
                 cur.execute('UPDATE reading_sessions SET ended_at = end_time WHERE ended_at IS NULL')
             except Exception:
-                pass
+                ok = False
 
         conn.commit()
+        return ok
     except Exception:
         try:
             if conn:
                 conn.rollback()
         except Exception:
             pass
+        return False
     finally:
         try:
             if conn:
@@ -102,15 +164,15 @@ def ensure_reading_sessions_schema():
 
 
 def ensure_books_schema():
-    """Ensure the books table has the category column so older databases are compatible."""
+    """Ensure the books table has the category column so older databases are compatible.
+    Returns True once the table is up to date, False if it is missing or the migration failed."""
     conn = None
     try:
         conn = get_db_connection()
         cur = conn.cursor()
         cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='books'")
         if cur.fetchone() is None:
-            conn.close()
-            return
+            return False
         cur.execute("PRAGMA table_info(books)")
         existing = [r[1] for r in cur.fetchall()]
         if 'category' not in existing:
@@ -122,12 +184,15 @@ def ensure_books_schema():
                     conn.rollback()
                 except Exception:
                     pass
+                return False
+        return True
     except Exception:
         try:
             if conn:
                 conn.rollback()
         except Exception:
             pass
+        return False
     finally:
         try:
             if conn:
@@ -136,16 +201,149 @@ def ensure_books_schema():
             pass
 
 
-# Ensure DB schema is compatible on startup (helps for existing older DBs)
-try:
-    ensure_reading_sessions_schema()
-    ensure_books_schema()
-except Exception:
-    # avoid crashing the import if migrations fail for any reason
-    pass
+def ensure_analytics_schema():
+    """Create the reading rollup tables (see analytics.py) if they are missing. Returns True on success."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        analytics.ensure_schema(conn)
+        return True
+    except Exception:
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+
+def ensure_progress_schema():
+    """Create the reading_progress table (see progress.py) if it is missing. Returns True on success."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        progress.ensure_schema(conn)
+        return True
+    except Exception:
+        return False
+    finally:
+        if conn:
+            conn.close()
 
 
-@app.template_filter('datetimeformat')
+def run_migrations(app):
+    """Bring an existing database up to SCHEMA_VERSION. A database that is already current
+    costs one PRAGMA read, so workers that start after a migrated master skip the work.
+    user_version is only bumped when every step succeeded; otherwise the steps run again on
+    the next start. Returns True when the database is current."""
+    if app.extensions.get('migrated'):
+        return True
+    ok = True
+    with app.app_context():
+        conn = get_db_connection()
+        try:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+        except sqlite3.Error:
+            version = 0
+        finally:
+            conn.close()
+        if version < SCHEMA_VERSION:
+            # Ensure DB schema is compatible (helps for existing older DBs); run every step
+            # even if an earlier one failed
+            steps = [ensure_reading_sessions_schema, ensure_books_schema,
+                     ensure_analytics_schema, ensure_progress_schema]
+            ok = all([step() for step in steps])
+            if ok:
+                try:
+                    conn = get_db_connection()
+                    conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+                    conn.close()
+                except Exception:
+                    # never stop the app from serving if migrations fail for any reason
+                    ok = False
+    if ok:
+        app.extensions['migrated'] = True
+    return ok
+
+
+def warm(app):
+    """Do one-off startup work ahead of time: migrations, extensions and template compilation.
+    Call it in a pre-fork master (e.g. gunicorn --preload with create_app(warm_up=True)) so every
+    forked worker inherits the result instead of paying for it on its first request."""
+    timer = app.extensions['startup']
+    with timer.phase('warm: auth'):
+        # resolves PASSWORD_HASH_METHOD with one hash, so a bad value stops the master here
+        auth.wanted_method()
+    with timer.phase('warm: migrations'):
+        run_migrations(app)
+    with app.app_context():
+        with timer.phase('warm: extensions'):
+            get_storage()
+            get_progress_buffer()
+        with timer.phase('warm: templates'):
+            for name in app.jinja_env.list_templates(extensions=['html']):
+                app.jinja_env.get_template(name)
+
+
+def create_app(config=None, warm_up=None):
+    """Build the Flask app. Work that touches the database or optional backends is deferred:
+    migrations run on the first request (or in warm()), extensions on first use.
+    config: optional dict merged into app.config, e.g. {'DATABASE': path} for a test database.
+    warm_up: run warm() now; defaults to the WARM_ON_START environment variable."""
+    timer = PhaseTimer()
+    timer.add('import app', _import_done - _import_started)
+    with timer.phase('create_app: config'):
+        app = Flask(__name__, instance_relative_config=True)
+        # secret key for session management; in production set via environment
+        app.secret_key = os.environ.get('SECRET_KEY', 'dev_secret_key')
+        app.config['DATABASE'] = os.path.join(app.instance_path, 'database.db')
+        if config:
+            app.config.update(config)
+        # ensure the instance folder exists (where the sqlite DB will live)
+        os.makedirs(app.instance_path, exist_ok=True)
+        app.extensions['startup'] = timer
+        # behind N reverse proxies / load balancers, trust their X-Forwarded-* headers so
+        # request.remote_addr (which keys the per-client suggest limiter) is the real client
+        trusted_proxies = int(os.environ.get('TRUSTED_PROXIES', 0))
+        if trusted_proxies:
+            from werkzeug.middleware.proxy_fix import ProxyFix
+            app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxies, x_proto=trusted_proxies,
+                                    x_host=trusted_proxies)
+    with timer.phase('create_app: blueprints'):
+        app.register_blueprint(bp)
+    if warm_up is None:
+        warm_up = bool(os.environ.get('WARM_ON_START'))
+    if warm_up:
+        warm(app)
+    return app
+
+
+@bp.before_app_request
+def _first_request_setup():
+    app = current_app._get_current_object()
+    if not app.extensions.get('migrated'):
+        timer = app.extensions['startup']
+        with _extensions_lock:
+            with timer.phase('first request: migrations'):
+                if not run_migrations(app):
+                    app.logger.warning('schema migrations incomplete; retrying on next start')
+                # one attempt per process; a failed step is retried by the next worker or restart
+                app.extensions['migrated'] = True
+    if not app.extensions.get('first_request_done') and 'first_request_started' not in app.extensions:
+        app.extensions['first_request_started'] = time.perf_counter()
+
+
+@bp.after_app_request
+def _first_request_done(response):
+    app = current_app._get_current_object()
+    started = app.extensions.pop('first_request_started', None)
+    if started is not None and not app.extensions.get('first_request_done'):
+        app.extensions['first_request_done'] = True
+        timer = app.extensions['startup']
+        timer.add(f'first request: {request.path}', time.perf_counter() - started)
+        timer.report()
+    return response
+
+
+@bp.app_template_filter('datetimeformat')
 def datetimeformat(value):
     """Format an integer epoch timestamp into a readable string."""
     try:
@@ -157,13 +355,21 @@ def datetimeformat(value):
         return str(value)
 
 
-@app.route('/')
+@bp.app_template_global('upload_url')
+def upload_url(key):
+    """Public URL for an uploaded file key, e.g. 'cover.jpg' or '10/001_page.png'."""
+    if not key:
+        return ''
+    return get_storage().url(key)
+
+
+@bp.route('/')
 def index():
     # Landing page
     return render_template('index.html')
 
 
-@app.route('/books')
+@bp.route('/books')
 def books():
     # show list of books from the DB
     conn = get_db_connection()
@@ -179,15 +385,28 @@ def books():
     return render_template('books.html', groups=groups)
 
 
-@app.route('/search/suggest')
-def search_suggest():
-    """Return JSON suggestions for live autocomplete.
-    Query param: q
-    Returns up to 8 matches across title and author.
-    """
-    q = request.args.get('q', '').strip()
-    if not q:
-        return jsonify({'suggestions': []})
+# Suggest is hit on every debounced keystroke. Identical in-flight queries share one DB
+# round trip, hot prefixes are served from a short-lived cache, and each client gets a
+# token bucket so bursts are shed with 429 rather than queued.
+SUGGEST_CACHE_TTL = float(os.environ.get('SUGGEST_CACHE_TTL', 10))
+
+
+def get_suggest_cache():
+    return _extension('suggest_cache', lambda app: throttle.TTLCache(ttl=SUGGEST_CACHE_TTL, max_entries=2048))
+
+
+def get_suggest_flight():
+    return _extension('suggest_flight', lambda app: throttle.SingleFlight())
+
+
+def get_suggest_limiter():
+    return _extension('suggest_limiter', lambda app: throttle.TokenBucketLimiter(
+        rate=float(os.environ.get('SUGGEST_RATE', 5)),
+        burst=float(os.environ.get('SUGGEST_BURST', 10)),
+    ))
+
+
+def _query_suggestions(q):
     q_like = f"%{q}%"
     conn = get_db_connection()
     cur = conn.cursor()
@@ -198,12 +417,35 @@ def search_suggest():
         ORDER BY id DESC
         LIMIT 8
     ''', (q_like, q_like)).fetchall()
-    results = [{'id': r['id'], 'title': r['title'], 'author': r['author'], 'image': r['image']} for r in rows]
+    results = [{'id': r['id'], 'title': r['title'], 'author': r['author'], 'image': r['image'],
+                'image_url': upload_url(r['image'])} for r in rows]
     conn.close()
+    get_suggest_cache().set(q, results)
+    return results
+
+
+@bp.route('/search/suggest')
+def search_suggest():
+    """Return JSON suggestions for live autocomplete.
+    Query param: q
+    Returns up to 8 matches across title and author.
+    """
+    q = request.args.get('q', '').strip()
+    if not q:
+        return jsonify({'suggestions': []})
+    client = f"u{session['user_id']}" if session.get('user_id') else request.remote_addr
+    allowed, retry_after = get_suggest_limiter().allow(client)
+    if not allowed:
+        resp = jsonify({'error': 'too many requests'})
+        resp.headers['Retry-After'] = str(max(1, round(retry_after)))
+        return resp, 429
+    results = get_suggest_cache().get(q)
+    if results is None:
+        results = get_suggest_flight().do(q, lambda: _query_suggestions(q))
     return jsonify({'suggestions': results})
 
 
-@app.route('/search')
+@bp.route('/search')
 def search():
     """Full-page search results. Query param: q"""
     q = request.args.get('q', '').strip()
@@ -232,18 +474,32 @@ def search():
     return render_template('books.html', groups=groups, query=q)
 
 
-@app.route('/books/<int:book_id>')
+@bp.route('/books/<int:book_id>')
 def book_detail(book_id):
     """Show a single book's details on its own page."""
     conn = get_db_connection()
     row = conn.execute('SELECT id, title, author, description, image, category FROM books WHERE id = ?', (book_id,)).fetchone()
-    conn.close()
     if row is None:
+        conn.close()
         flash('Book not found.')
-        return redirect(url_for('books'))
+        return redirect(url_for('main.books'))
     book = dict(row)
-    return render_template('book_detail.html', book=book)
-@app.route('/books/<int:book_id>/read')
+    # neighbours precomputed offline by recommend.py (primary key lookup on book_id, rank)
+    try:
+        rows = conn.execute('''
+            SELECT b.id, b.title, b.author, b.image
+            FROM book_similarities s
+            JOIN books b ON b.id = s.similar_book_id
+            WHERE s.book_id = ?
+            ORDER BY s.rank
+        ''', (book_id,)).fetchall()
+        similar = [dict(r) for r in rows]
+    except sqlite3.OperationalError:
+        # table not created yet (job never ran)
+        similar = []
+    conn.close()
+    return render_template('book_detail.html', book=book, similar=similar)
+@bp.route('/books/<int:book_id>/read')
 def book_read(book_id):
     """Reader view: load book and its pages and render the reader template."""
     conn = get_db_connection()
@@ -251,36 +507,49 @@ def book_read(book_id):
     conn.close()
     if row is None:
         flash('Book not found.')
-        return redirect(url_for('books'))
+        return redirect(url_for('main.books'))
     book = dict(row)
     # load page URLs to pass into the template for immediate rendering
     conn = get_db_connection()
     rows = conn.execute('SELECT filename FROM book_pages WHERE book_id = ? ORDER BY page_number ASC', (book_id,)).fetchall()
     conn.close()
     files = [r['filename'] for r in rows]
-    urls = [url_for('static', filename=f'uploads/{book_id}/{fn}') for fn in files]
-    return render_template('book_read.html', book=book, pages=urls)
-
-
-@app.route('/books/<int:book_id>/pages')
+    urls = [get_storage().url(f'{book_id}/{fn}') for fn in files]
+    # resume where the reader left off
+    start, single = 0, False
+    if session.get('user_id'):
+        saved = get_progress_buffer().get(session['user_id'], book_id)
+        if saved:
+            single = saved['single_mode']
+            start = max(0, min(saved['page_index'], len(urls) - 1))
+            if not single:
+                # spreads always start on an even page
+                start -= start % 2
+    # preload the current spread and the pages either side of it
+    step = 1 if single else 2
+    preload = urls[max(0, start - step):start + 2 * step]
+    return render_template('book_read.html', book=book, pages=urls, start=start, single=single, preload=preload)
+
+
+@bp.route('/books/<int:book_id>/pages')
 def book_pages(book_id):
     """Return JSON list of page image URLs for the reader JS."""
     conn = get_db_connection()
     rows = conn.execute('SELECT filename FROM book_pages WHERE book_id = ? ORDER BY page_number ASC', (book_id,)).fetchall()
     conn.close()
     files = [r['filename'] for r in rows]
-    # construct URLs relative to /static/uploads/<book_id>/filename
-    urls = [url_for('static', filename=f'uploads/{book_id}/{fn}') for fn in files]
+    # construct URLs for <book_id>/<filename> through the storage backend
+    urls = [get_storage().url(f'{book_id}/{fn}') for fn in files]
     from flask import jsonify
     return jsonify({'pages': urls})
 
 
 # -- Admin routes to manage books (simple, no separate admin user for demo) --
-@app.route('/admin/books')
+@bp.route('/admin/books')
 def admin_books():
     # require admin password/session
     if not session.get('is_admin'):
-        return redirect(url_for('admin_login'))
+        return redirect(url_for('main.admin_login'))
     conn = get_db_connection()
     # include image column so admin list can reflect uploaded covers (if desired later)
     rows = conn.execute('SELECT id, title, author, description, image, category FROM books ORDER BY id DESC').fetchall()
@@ -289,90 +558,196 @@ def admin_books():
     return render_template('admin_books.html', books=books)
 
 
-@app.route('/admin/books/<int:book_id>/pages', methods=['GET', 'POST'])
+@bp.route('/admin/books/<int:book_id>/pages', methods=['GET', 'POST'])
 def admin_book_pages(book_id):
     # only accessible to admin
     if not session.get('is_admin'):
-        return redirect(url_for('admin_login'))
+        return redirect(url_for('main.admin_login'))
 
     conn = get_db_connection()
     row = conn.execute('SELECT id, title FROM books WHERE id = ?', (book_id,)).fetchone()
     if row is None:
         conn.close()
         flash('Book not found.')
-        return redirect(url_for('admin_books'))
+        return redirect(url_for('main.admin_books'))
 
     if request.method == 'POST':
         # allow uploading additional pages and reordering isn't implemented here
         pages = request.files.getlist('pages')
         if pages:
-            uploads_dir = os.path.join(app.static_folder, 'uploads')
-            book_dir = os.path.join(uploads_dir, str(book_id))
-            os.makedirs(book_dir, exist_ok=True)
             cur = conn.cursor()
             # determine next page number
             cur.execute('SELECT COALESCE(MAX(page_number), 0) FROM book_pages WHERE book_id = ?', (book_id,))
             start = cur.fetchone()[0] or 0
             pnum = start + 1
+            uploads = []
             for p in pages:
                 if p and p.filename:
                     safe_name = os.path.basename(p.filename)
                     name = f"{pnum:03d}_{safe_name}"
-                    path = os.path.join(book_dir, name)
-                    p.save(path)
+                    uploads.append((f'{book_id}/{name}', p))
                     cur.execute('INSERT INTO book_pages (book_id, filename, page_number) VALUES (?, ?, ?)', (book_id, name, pnum))
                     pnum += 1
+            get_storage().save_many(uploads)
             conn.commit()
+            _make_thumbnails_async(book_id, [key.split('/', 1)[1] for key, _ in uploads])
         conn.close()
-        return redirect(url_for('admin_book_pages', book_id=book_id))
+        return redirect(url_for('main.admin_book_pages', book_id=book_id))
 
-    rows = conn.execute('SELECT id, filename, page_number FROM book_pages WHERE book_id = ? ORDER BY page_number ASC', (book_id,)).fetchall()
-    pages = [dict(r) for r in rows]
+    # the grid itself is loaded in chunks from admin_book_pages_json by admin_pages.js
+    total = conn.execute('SELECT COUNT(*) FROM book_pages WHERE book_id = ?', (book_id,)).fetchone()[0]
     conn.close()
-    return render_template('admin_book_pages.html', book=dict(row), pages=pages)
+    return render_template('admin_book_pages.html', book=dict(row), total=total)
+
+
+def _make_thumbnails_async(book_id, filenames):
+    """Render page thumbnails in the background so uploads return immediately."""
+    if not filenames or not thumbnails.available():
+        return
+    # the worker thread has no app context, so hand it the objects it needs
+    storage = get_storage()
+    logger = current_app.logger
 
+    def work():
+        for fn in filenames:
+            try:
+                thumbnails.make_thumbnail(storage, book_id, fn)
+            except Exception:
+                logger.exception('thumbnail failed for %s/%s', book_id, fn)
 
-@app.route('/admin/books/<int:book_id>/pages/delete/<int:page_id>', methods=['POST'])
+    threading.Thread(target=work, daemon=True).start()
+
+
+@bp.route('/admin/books/<int:book_id>/pages.json')
+def admin_book_pages_json(book_id):
+    """One window of a book's pages for the admin grid. Query params: offset, limit (max 200)."""
+    if not session.get('is_admin'):
+        return jsonify({'error': 'admin required'}), 401
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = max(1, min(request.args.get('limit', 100, type=int), 200))
+    conn = get_db_connection()
+    total = conn.execute('SELECT COUNT(*) FROM book_pages WHERE book_id = ?', (book_id,)).fetchone()[0]
+    rows = conn.execute('SELECT id, filename, page_number FROM book_pages WHERE book_id = ? '
+                        'ORDER BY page_number ASC LIMIT ? OFFSET ?', (book_id, limit, offset)).fetchall()
+    conn.close()
+    pages = [{'id': r['id'], 'page_number': r['page_number'], 'filename': r['filename'],
+              'thumb': url_for('main.admin_book_page_thumb', book_id=book_id, page_id=r['id'])} for r in rows]
+    return jsonify({'total': total, 'offset': offset, 'pages': pages})
+
+
+@bp.route('/admin/books/<int:book_id>/pages/<int:page_id>/thumb')
+def admin_book_page_thumb(book_id, page_id):
+    """Redirect to a page's thumbnail, rendering it on first request (or to the original without Pillow)."""
+    if not session.get('is_admin'):
+        return redirect(url_for('main.admin_login'))
+    conn = get_db_connection()
+    row = conn.execute('SELECT filename FROM book_pages WHERE id = ? AND book_id = ?', (page_id, book_id)).fetchone()
+    conn.close()
+    if row is None:
+        return ('', 404)
+    key = thumbnails.thumb_key(book_id, row['filename'])
+    if get_storage().exists(key) or thumbnails.make_thumbnail(get_storage(), book_id, row['filename']):
+        resp = redirect(get_storage().url(key))
+        # page ids are never reused for another file, so the browser may keep this for a day
+        resp.headers['Cache-Control'] = 'private, max-age=86400'
+    else:
+        # no Pillow or unreadable original: don't let the browser pin the full-size fallback
+        resp = redirect(get_storage().url(f"{book_id}/{row['filename']}"))
+        resp.headers['Cache-Control'] = 'no-store'
+    return resp
+
+
+@bp.route('/admin/books/<int:book_id>/pages/bulk', methods=['POST'])
+def admin_book_pages_bulk(book_id):
+    """Delete or move many pages in one transaction.
+    Expects JSON: {"action": "delete", "page_ids": [...]}
+               or {"action": "move", "page_ids": [...], "position": <1-based position to move them to>}
+    """
+    if not session.get('is_admin'):
+        return jsonify({'error': 'admin required'}), 401
+    data = request.get_json(silent=True) or {}
+    action = data.get('action')
+    try:
+        page_ids = {int(i) for i in data.get('page_ids') or []}
+    except (TypeError, ValueError):
+        return jsonify({'error': 'page_ids must be integers'}), 400
+    if action not in ('delete', 'move') or not page_ids:
+        return jsonify({'error': 'action and page_ids required'}), 400
+    conn = get_db_connection()
+    cur = conn.cursor()
+    rows = cur.execute('SELECT id, filename FROM book_pages WHERE book_id = ? ORDER BY page_number ASC, id ASC',
+                       (book_id,)).fetchall()
+    selected = [r for r in rows if r['id'] in page_ids]
+    if not selected:
+        conn.close()
+        return jsonify({'error': 'no matching pages'}), 404
+    try:
+        if action == 'delete':
+            cur.executemany('DELETE FROM book_pages WHERE id = ? AND book_id = ?', [(r['id'], book_id) for r in selected])
+        else:
+            position = data.get('position')
+            try:
+                position = int(position)
+            except (TypeError, ValueError):
+                conn.close()
+                return jsonify({'error': 'position required'}), 400
+            # lift the selected pages out (keeping their order) and insert them as a block
+            rest = [r['id'] for r in rows if r['id'] not in page_ids]
+            at = max(0, min(position - 1, len(rest)))
+            order = rest[:at] + [r['id'] for r in selected] + rest[at:]
+            cur.executemany('UPDATE book_pages SET page_number = ? WHERE id = ?',
+                            [(n, pid) for n, pid in enumerate(order, 1)])
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        conn.close()
+        return jsonify({'error': 'update failed'}), 500
+    conn.close()
+    if action == 'delete':
+        # files go only after the rows are gone, so a failed transaction never loses images
+        for r in selected:
+            get_storage().delete(f"{book_id}/{r['filename']}")
+            thumbnails.delete_thumbnail(get_storage(), book_id, r['filename'])
+    return jsonify({'ok': True, 'action': action, 'count': len(selected)})
+
+
+@bp.route('/admin/books/<int:book_id>/pages/delete/<int:page_id>', methods=['POST'])
 def admin_book_page_delete(book_id, page_id):
     if not session.get('is_admin'):
-        return redirect(url_for('admin_login'))
+        return redirect(url_for('main.admin_login'))
     conn = get_db_connection()
     cur = conn.cursor()
     row = cur.execute('SELECT filename FROM book_pages WHERE id = ? AND book_id = ?', (page_id, book_id)).fetchone()
     if row is None:
         conn.close()
         flash('Page not found.')
-        return redirect(url_for('admin_book_pages', book_id=book_id))
+        return redirect(url_for('main.admin_book_pages', book_id=book_id))
     filename = row['filename']
-    # delete file from disk if exists
-    file_path = os.path.join(app.static_folder, 'uploads', str(book_id), filename)
-    try:
-        if os.path.exists(file_path):
-            os.remove(file_path)
-    except Exception:
-        pass
+    # delete the stored file if it exists
+    get_storage().delete(f'{book_id}/{filename}')
+    thumbnails.delete_thumbnail(get_storage(), book_id, filename)
     cur.execute('DELETE FROM book_pages WHERE id = ? AND book_id = ?', (page_id, book_id))
     conn.commit()
     conn.close()
     flash('Page deleted.')
-    return redirect(url_for('admin_book_pages', book_id=book_id))
+    return redirect(url_for('main.admin_book_pages', book_id=book_id))
 
 
-@app.route('/admin/books/<int:book_id>/pages/move/<int:page_id>', methods=['POST'])
+@bp.route('/admin/books/<int:book_id>/pages/move/<int:page_id>', methods=['POST'])
 def admin_book_page_move(book_id, page_id):
     if not session.get('is_admin'):
-        return redirect(url_for('admin_login'))
+        return redirect(url_for('main.admin_login'))
     direction = request.form.get('direction')
     if direction not in ('up','down'):
         flash('Invalid move direction.')
-        return redirect(url_for('admin_book_pages', book_id=book_id))
+        return redirect(url_for('main.admin_book_pages', book_id=book_id))
     conn = get_db_connection()
     cur = conn.cursor()
     row = cur.execute('SELECT id, page_number FROM book_pages WHERE id = ? AND book_id = ?', (page_id, book_id)).fetchone()
     if row is None:
         conn.close()
         flash('Page not found.')
-        return redirect(url_for('admin_book_pages', book_id=book_id))
+        return redirect(url_for('main.admin_book_pages', book_id=book_id))
     cur_num = row['page_number']
     if direction == 'up':
         # find page with page_number immediately less than current
@@ -382,7 +757,7 @@ def admin_book_page_move(book_id, page_id):
     if other is None:
         conn.close()
         flash('Cannot move further.')
-        return redirect(url_for('admin_book_pages', book_id=book_id))
+        return redirect(url_for('main.admin_book_pages', book_id=book_id))
     # swap page_number values
     try:
         cur.execute('UPDATE book_pages SET page_number = ? WHERE id = ?', (-1, page_id))
@@ -392,31 +767,150 @@ def admin_book_page_move(book_id, page_id):
     except Exception:
         conn.rollback()
     conn.close()
-    return redirect(url_for('admin_book_pages', book_id=book_id))
+    return redirect(url_for('main.admin_book_pages', book_id=book_id))
+
+
+@bp.route('/admin/analytics')
+def admin_analytics():
+    """Catalog-wide reading activity dashboard, served from the rollup tables."""
+    if not session.get('is_admin'):
+        return redirect(url_for('main.admin_login'))
+    dim = request.args.get('dim', 'category')
+    if dim not in analytics.DIMENSIONS:
+        dim = 'category'
+    days = request.args.get('days', 90, type=int)
+    conn = get_db_connection()
+    data = analytics.query(conn, dim, grain='day', days=max(1, min(days, 365)))
+    # book dimension values are ids; show titles instead
+    labels = {}
+    if dim == 'book' and data['series']:
+        ids = list(data['series'].keys())
+        rows = conn.execute(f"SELECT id, title FROM books WHERE id IN ({', '.join('?' * len(ids))})", ids).fetchall()
+        labels = {str(r['id']): r['title'] for r in rows}
+    conn.close()
+    totals = sorted(
+        ({'label': labels.get(k, k), 'minutes': round(sum(v['minutes']), 1), 'sessions': sum(v['sessions'])}
+         for k, v in data['series'].items()),
+        key=lambda t: t['minutes'], reverse=True)
+    return render_template('admin_analytics.html', dim=dim, days=days, totals=totals,
+                           dimensions=analytics.DIMENSIONS)
+
+
+@bp.route('/admin/analytics/api')
+def admin_analytics_api():
+    """JSON reading series. Query params: dim (book|category|age_band), grain (hour|day), days."""
+    if not session.get('is_admin'):
+        return jsonify({'error': 'admin required'}), 401
+    dim = request.args.get('dim', 'category')
+    grain = request.args.get('grain', 'day')
+    days = request.args.get('days', 90, type=int)
+    conn = get_db_connection()
+    try:
+        data = analytics.query(conn, dim, grain=grain, days=max(1, min(days, 365)))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        conn.close()
+    return jsonify(data)
+
+
+@bp.route('/admin/analytics/sessions.parquet')
+def admin_analytics_export():
+    """Download raw reading sessions as Parquet for offline analysis."""
+    if not session.get('is_admin'):
+        return redirect(url_for('main.admin_login'))
+    import tempfile
+    # spool to disk rather than memory; the file is removed when the response closes it
+    out = tempfile.TemporaryFile()
+    conn = get_db_connection()
+    try:
+        analytics.export_parquet(conn, out)
+    except RuntimeError as e:
+        out.close()
+        flash(str(e))
+        return redirect(url_for('main.admin_analytics'))
+    finally:
+        conn.close()
+    out.seek(0)
+    return send_file(out, mimetype='application/vnd.apache.parquet', as_attachment=True,
+                     download_name='reading_sessions.parquet')
+
+
+def _backup_lock():
+    """Only one backup may run at a time; it runs in a background thread so the request returns at once."""
+    return _extension('backup_lock', lambda app: threading.Lock())
+
+
+def _backup_dir():
+    return os.environ.get('BACKUP_DIR', os.path.join(current_app.instance_path, 'backups'))
+
+
+def _run_backup(app, storage, lock):
+    import backup
+    try:
+        with app.app_context():
+            backup.create(app.config['DATABASE'], _backup_dir(), storage=storage)
+    except Exception:
+        app.logger.exception('backup failed')
+    finally:
+        lock.release()
+
+
+@bp.route('/admin/backups', methods=['GET', 'POST'])
+def admin_backups():
+    """List snapshots and start a new online backup."""
+    if not session.get('is_admin'):
+        return redirect(url_for('main.admin_login'))
+    if request.method == 'POST':
+        lock = _backup_lock()
+        if lock.acquire(blocking=False):
+            storage = get_storage() if request.form.get('uploads') else None
+            threading.Thread(target=_run_backup, args=(current_app._get_current_object(), storage, lock), daemon=True).start()
+            flash('Backup started.')
+        else:
+            flash('A backup is already running.')
+        return redirect(url_for('main.admin_backups'))
+    import backup
+    snapshots = backup.list_snapshots(_backup_dir())
+    return render_template('admin_backups.html', snapshots=snapshots, running=_backup_lock().locked())
 
 
-@app.route('/admin/login', methods=['GET', 'POST'])
+@bp.route('/admin/backups/<name>/verify', methods=['POST'])
+def admin_backup_verify(name):
+    if not session.get('is_admin'):
+        return redirect(url_for('main.admin_login'))
+    import backup
+    path = os.path.join(_backup_dir(), os.path.basename(name) + '.json')
+    if not os.path.exists(path):
+        flash('Snapshot not found.')
+        return redirect(url_for('main.admin_backups'))
+    problems = backup.verify(path)
+    flash(f'{name}: OK' if not problems else f'{name}: ' + '; '.join(problems))
+    return redirect(url_for('main.admin_backups'))
+
+
+@bp.route('/admin/login', methods=['GET', 'POST'])
 def admin_login():
     if request.method == 'POST':
         pw = request.form.get('password', '')
         if pw == ADMIN_PASSWORD:
             session['is_admin'] = True
             flash('Admin signed in.')
-            return redirect(url_for('admin_books'))
+            return redirect(url_for('main.admin_books'))
         else:
             flash('Invalid admin password.')
-            return redirect(url_for('admin_login'))
+            return redirect(url_for('main.admin_login'))
     return render_template('admin_login.html')
 
 
-@app.route('/admin/logout')
+@bp.route('/admin/logout')
 def admin_logout():
     session.pop('is_admin', None)
     flash('Admin logged out.')
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
 
-@app.route('/admin/books/add', methods=['POST'])
+@bp.route('/admin/books/add', methods=['POST'])
 def admin_books_add():
     title = request.form.get('title', '').strip()
     author = request.form.get('author', '').strip()
@@ -425,13 +919,10 @@ def admin_books_add():
     image_file = request.files.get('image')
     image_filename = None
     if image_file and image_file.filename:
-        uploads_dir = os.path.join(app.static_folder, 'uploads')
-        os.makedirs(uploads_dir, exist_ok=True)
         # simple filename sanitization
         fname = os.path.basename(image_file.filename)
         image_filename = fname
-        image_path = os.path.join(uploads_dir, image_filename)
-        image_file.save(image_path)
+        get_storage().save(image_filename, image_file)
 
     # handle multiple page uploads (PNG expected)
     pages = request.files.getlist('pages')
@@ -442,36 +933,38 @@ def admin_books_add():
         cur.execute('INSERT INTO books (title, author, description, image, category) VALUES (?, ?, ?, ?, ?)', (title, author, description, image_filename, category))
         book_id = cur.lastrowid
         # save page records after creating book
-        uploads_dir = os.path.join(app.static_folder, 'uploads')
-        book_dir = os.path.join(uploads_dir, str(book_id))
         if pages:
-            os.makedirs(book_dir, exist_ok=True)
             page_num = 1
+            uploads = []
             for p in pages:
                 if p and p.filename:
                     # keep original filename but prefix with page number to avoid collisions
                     safe_name = os.path.basename(p.filename)
                     # ensure png extension
                     name = f"{page_num:03d}_{safe_name}"
-                    path = os.path.join(book_dir, name)
-                    p.save(path)
+                    uploads.append((f'{book_id}/{name}', p))
                     cur.execute('INSERT INTO book_pages (book_id, filename, page_number) VALUES (?, ?, ?)', (book_id, name, page_num))
                     page_num += 1
+            # bulk upload; the object-store backend sends these concurrently
+            get_storage().save_many(uploads)
+            _make_thumbnails_async(book_id, [key.split('/', 1)[1] for key, _ in uploads])
         conn.commit()
         conn.close()
-    return redirect(url_for('admin_books'))
+        get_suggest_cache().clear()
+    return redirect(url_for('main.admin_books'))
 
 
-@app.route('/admin/books/delete/<int:book_id>', methods=['POST'])
+@bp.route('/admin/books/delete/<int:book_id>', methods=['POST'])
 def admin_books_delete(book_id):
     conn = get_db_connection()
     conn.execute('DELETE FROM books WHERE id = ?', (book_id,))
     conn.commit()
     conn.close()
-    return redirect(url_for('admin_books'))
+    get_suggest_cache().clear()
+    return redirect(url_for('main.admin_books'))
 
 
-@app.route('/add', methods=['POST'])
+@bp.route('/add', methods=['POST'])
 def add():
     title = request.form.get('title', '').strip()
     content = request.form.get('content', '').strip()
@@ -480,19 +973,19 @@ def add():
         conn.execute('INSERT INTO notes (title, content) VALUES (?, ?)', (title, content))
         conn.commit()
         conn.close()
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
 
-@app.route('/delete/<int:note_id>', methods=['POST'])
+@bp.route('/delete/<int:note_id>', methods=['POST'])
 def delete(note_id):
     conn = get_db_connection()
     conn.execute('DELETE FROM notes WHERE id = ?', (note_id,))
     conn.commit()
     conn.close()
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
 
-@app.route('/register', methods=['GET', 'POST'])
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         name = request.form.get('name', '').strip()
@@ -501,13 +994,13 @@ def register():
 
         if not name or not age or not password:
             flash('Please fill out all required fields.')
-            return redirect(url_for('register'))
+            return redirect(url_for('main.register'))
 
         try:
             age_int = int(age)
         except ValueError:
             flash('Age must be a number.')
-            return redirect(url_for('register'))
+            return redirect(url_for('main.register'))
 
         conn = get_db_connection()
         cur = conn.cursor()
@@ -515,19 +1008,26 @@ def register():
         if cur.fetchone() is not None:
             conn.close()
             flash('A user with that name already exists.')
-            return redirect(url_for('register'))
+            return redirect(url_for('main.register'))
 
-        pw_hash = generate_password_hash(password)
+        try:
+            pw_hash = auth.hash_password(password)
+        except auth.AuthBusy:
+            conn.close()
+            flash('The server is busy, please try again in a moment.')
+            return redirect(url_for('main.register'))
         cur.execute('INSERT INTO users (name, age, password_hash) VALUES (?, ?, ?)', (name, age_int, pw_hash))
         conn.commit()
+        # drop anything cached under the new id (e.g. from a deleted user that reused it)
+        get_user_cache().invalidate(cur.lastrowid)
         conn.close()
         flash('Registration successful. Please log in.')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
 
     return render_template('register.html')
 
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         # login: accept name and password (age is provided only during registration)
@@ -535,7 +1035,7 @@ def login():
         password = request.form.get('password', '')
         if not name or not password:
             flash('Please provide name and password.')
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
 
         conn = get_db_connection()
         cur = conn.cursor()
@@ -546,15 +1046,31 @@ def login():
             # keep the user on the login page and show a message instead of forcing a redirect
             conn.close()
             flash('No account found with that name. Please register or check the name.')
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
 
         stored_hash = row['password_hash']
-        if not check_password_hash(stored_hash, password):
+        # hashing runs on a bounded worker pool; turn the login away rather than queue forever
+        try:
+            ok = auth.verify_password(stored_hash, password)
+        except auth.AuthBusy:
+            conn.close()
+            flash('The server is busy, please try again in a moment.')
+            return redirect(url_for('main.login'))
+        if not ok:
             conn.close()
             flash('Invalid name or password.')
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
 
         user_id = row['id']
+        # transparently upgrade hashes made with an older method or cost
+        if auth.needs_rehash(stored_hash):
+            try:
+                cur.execute('UPDATE users SET password_hash = ? WHERE id = ?', (auth.hash_password(password), user_id))
+                conn.commit()
+            except (auth.AuthBusy, sqlite3.Error):
+                # keep the old hash; we'll try again on the next login
+                pass
+            get_user_cache().invalidate(user_id)
         user_age = row['age']
         user_image = row['image'] if 'image' in row.keys() else None
         conn.close()
@@ -565,24 +1081,25 @@ def login():
         if user_image:
             session['user_image'] = user_image
         flash('Welcome, {}!'.format(name))
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
 
     return render_template('login.html')
 
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     session.clear()
     flash('You have been logged out.')
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
 
-@app.route('/reading/start', methods=['POST'])
+@bp.route('/reading/start', methods=['POST'])
 def reading_start():
     """Start a reading session for the current user and book.
     Expects JSON: {"book_id": <int>} Returns JSON {session_id, started_at}
     """
-    if not session.get('user_id'):
+    # cached lookup, so a deleted account can't keep recording sessions
+    if get_current_user() is None:
         return jsonify({'error': 'authentication required'}), 401
     data = request.get_json() or {}
     book_id = data.get('book_id')
@@ -615,7 +1132,7 @@ def reading_start():
     return jsonify({'session_id': session_id, 'started_at': started_at})
 
 
-@app.route('/reading/stop', methods=['POST'])
+@bp.route('/reading/stop', methods=['POST'])
 def reading_stop():
     """Stop a reading session. Expects JSON: {"session_id": <int>} Returns JSON with duration."""
     if not session.get('user_id'):
@@ -627,7 +1144,7 @@ def reading_stop():
     ended_at = int(time.time())
     conn = get_db_connection()
     cur = conn.cursor()
-    row = cur.execute('SELECT id, user_id, started_at, ended_at FROM reading_sessions WHERE id = ?', (session_id,)).fetchone()
+    row = cur.execute('SELECT id, user_id, book_id, started_at, ended_at FROM reading_sessions WHERE id = ?', (session_id,)).fetchone()
     if row is None:
         conn.close()
         return jsonify({'error': 'session not found'}), 404
@@ -639,21 +1156,54 @@ def reading_stop():
         return jsonify({'error': 'already stopped'}), 400
     duration = ended_at - row['started_at']
     cur.execute('UPDATE reading_sessions SET ended_at = ?, duration_seconds = ? WHERE id = ?', (ended_at, duration, session_id))
+    # fold into the analytics rollups in the same transaction so they never double count;
+    # the savepoint drops a half-written rollup without losing the session update
+    cur.execute('SAVEPOINT rollup')
+    try:
+        analytics.record_session(conn, row['user_id'], row['book_id'], row['started_at'], duration)
+    except sqlite3.Error:
+        # rollups can be recomputed with `python analytics.py --rebuild`
+        cur.execute('ROLLBACK TO rollup')
+    cur.execute('RELEASE rollup')
     conn.commit()
     conn.close()
     return jsonify({'session_id': session_id, 'ended_at': ended_at, 'duration_seconds': duration})
 
 
-@app.route('/profile')
+@bp.route('/reading/progress', methods=['POST'])
+def reading_progress():
+    """Record the reader's position. Expects JSON: {"book_id": <int>, "page": <0-based index>, "single": <bool>}"""
+    if not session.get('user_id'):
+        return jsonify({'error': 'authentication required'}), 401
+    data = request.get_json(silent=True) or {}
+    try:
+        book_id = int(data.get('book_id'))
+        page = max(0, int(data.get('page', 0)))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'book_id and page required'}), 400
+    get_progress_buffer().record(session['user_id'], book_id, page, bool(data.get('single')))
+    return ('', 204)
+
+
+@bp.route('/profile')
 def profile():
     if not session.get('user_id'):
         flash('Please log in to view your profile.')
-        return redirect(url_for('login'))
-    user_id = session['user_id']
+        return redirect(url_for('main.login'))
+    user = get_current_user()
+    if user is None:
+        # account no longer exists
+        session.clear()
+        flash('Please log in to view your profile.')
+        return redirect(url_for('main.login'))
+    user_id = user['id']
     conn = get_db_connection()
-    # Select only the most recent session per book so the same book doesn't appear multiple times
+    # Select only the most recent session per book so the same book doesn't appear multiple times.
+    # Saved position and page count come along in the same query for the percentage read.
     rows = conn.execute('''
-        SELECT rs.id, rs.book_id, rs.started_at, rs.ended_at, rs.duration_seconds, b.title, b.image as image
+        SELECT rs.id, rs.book_id, rs.started_at, rs.ended_at, rs.duration_seconds, b.title, b.image as image,
+               rp.page_index, rp.single_mode,
+               (SELECT COUNT(*) FROM book_pages bp WHERE bp.book_id = rs.book_id) AS page_count
         FROM reading_sessions rs
         JOIN (
             SELECT book_id, MAX(started_at) AS max_started
@@ -662,10 +1212,21 @@ def profile():
             GROUP BY book_id
         ) m ON rs.book_id = m.book_id AND rs.started_at = m.max_started
         LEFT JOIN books b ON b.id = rs.book_id
+        LEFT JOIN reading_progress rp ON rp.user_id = rs.user_id AND rp.book_id = rs.book_id
         WHERE rs.user_id = ?
         ORDER BY rs.started_at DESC
     ''', (user_id, user_id)).fetchall()
     sessions = [dict(r) for r in rows]
+    pending = get_progress_buffer().pending_for_user(user_id)
+    for s in sessions:
+        pos = pending.get(s['book_id'])
+        if pos:
+            s['page_index'], s['single_mode'] = pos['page_index'], pos['single_mode']
+        s['percent_read'] = None
+        if s['page_index'] is not None and s['page_count']:
+            # pages on screen count as read: one in single mode, two for a spread
+            seen = min(s['page_count'], s['page_index'] + (1 if s['single_mode'] else 2))
+            s['percent_read'] = round(100 * seen / s['page_count'])
     agg = conn.execute('''
         SELECT b.id as book_id, b.title, b.image as image, COALESCE(SUM(rs.duration_seconds),0) as total_seconds,
                MAX(rs.started_at) as last_started
@@ -678,31 +1239,29 @@ def profile():
     totals = [dict(r) for r in agg]
     total_overall = sum(r['total_seconds'] for r in totals) if totals else 0
     conn.close()
-    return render_template('profile.html', sessions=sessions, totals=totals, total_overall=total_overall)
+    return render_template('profile.html', user=user, sessions=sessions, totals=totals, total_overall=total_overall)
 
 
-@app.route('/profile/upload', methods=['POST'])
+@bp.route('/profile/upload', methods=['POST'])
 def profile_upload():
     if not session.get('user_id'):
         flash('Please log in to update your profile.')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     file = request.files.get('profile_image')
     if not file or not file.filename:
         flash('No file selected.')
-        return redirect(url_for('profile'))
+        return redirect(url_for('main.profile'))
     # save to uploads/profile_<user_id>_filename
-    uploads_dir = os.path.join(app.static_folder, 'uploads')
-    os.makedirs(uploads_dir, exist_ok=True)
     safe_name = os.path.basename(file.filename)
     filename = f"profile_{session['user_id']}_{safe_name}"
-    path = os.path.join(uploads_dir, filename)
-    file.save(path)
+    get_storage().save(filename, file)
     # update users table
     conn = get_db_connection()
     cur = conn.cursor()
     try:
         cur.execute('UPDATE users SET image = ? WHERE id = ?', (filename, session['user_id']))
         conn.commit()
+        get_user_cache().invalidate(session['user_id'])
         # update session so new image appears immediately
         session['user_image'] = filename
     except Exception:
@@ -710,9 +1269,23 @@ def profile_upload():
     finally:
         conn.close()
     flash('Profile image updated.')
-    return redirect(url_for('profile'))
+    return redirect(url_for('main.profile'))
+
+
+_import_done = time.perf_counter()
+_default_app = None
+
+
+def __getattr__(name):
+    # `app.app` (e.g. gunicorn app:app) builds the default app on first access
+    global _default_app
+    if name == 'app':
+        if _default_app is None:
+            _default_app = create_app()
+        return _default_app
+    raise AttributeError(name)
 
 
 if __name__ == '__main__':
     # simple development server
-    app.run(debug=True)
+    create_app().run(debug=True)
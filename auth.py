@@ -0,0 +1,87 @@
+"""Password hashing off the request thread and a small TTL cache of user records.
+
+hashlib's PBKDF2/scrypt release the GIL, so a few worker threads verify hashes in
+parallel while the number of verifications in flight stays bounded. When the bound is
+reached a login waits briefly and then fails fast (AuthBusy) instead of piling up work.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+import throttle
+
+# werkzeug method string new and upgraded hashes use, e.g. 'scrypt:32768:8:1' or 'pbkdf2:sha256:600000'
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+HASH_WORKERS = int(os.environ.get('AUTH_HASH_WORKERS', max(2, (os.cpu_count() or 2))))
+# verifications allowed in flight (running + queued) before new logins are turned away
+MAX_PENDING = int(os.environ.get('AUTH_MAX_PENDING', HASH_WORKERS * 4))
+ACQUIRE_TIMEOUT = float(os.environ.get('AUTH_ACQUIRE_TIMEOUT', 2.0))
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 60))
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 4096))
+
+_pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='pwhash')
+_slots = threading.BoundedSemaphore(MAX_PENDING)
+
+
+class AuthBusy(Exception):
+    """Raised when too many password checks are already in flight."""
+
+
+def _run_bounded(fn, *args):
+    if not _slots.acquire(timeout=ACQUIRE_TIMEOUT):
+        raise AuthBusy()
+    try:
+        return _pool.submit(fn, *args).result()
+    finally:
+        _slots.release()
+
+
+def hash_password(password):
+    return _run_bounded(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+
+def verify_password(stored_hash, password):
+    return _run_bounded(check_password_hash, stored_hash, password)
+
+
+def _method_of(pw_hash):
+    return (pw_hash or '').split('$', 1)[0]
+
+
+@lru_cache(maxsize=1)
+def wanted_method():
+    """The full method string new hashes are stamped with, e.g. 'scrypt:32768:8:1'.
+    werkzeug fills in whatever PASSWORD_HASH_METHOD leaves out ('pbkdf2:sha256' gets the
+    default iterations), so this hashes once rather than trusting the setting. Costs one
+    hash on first call; raises ValueError for a bad setting. warm() calls it at startup."""
+    return _method_of(generate_password_hash('', PASSWORD_HASH_METHOD))
+
+
+def needs_rehash(stored_hash):
+    """True when the stored hash was made with a different method or cost than configured."""
+    return _method_of(stored_hash) != wanted_method()
+
+
+class UserCache:
+    """Small TTL + LRU cache of user rows keyed by user id (dicts, never sqlite3.Row)."""
+
+    def __init__(self, ttl=USER_CACHE_TTL, max_entries=USER_CACHE_SIZE):
+        self._cache = throttle.TTLCache(ttl, max_entries=max_entries)
+
+    def get(self, user_id, loader):
+        """Return the cached user, calling loader(user_id) on a miss or after expiry."""
+        user = self._cache.get(user_id)
+        if user is None:
+            user = loader(user_id)
+            if user is not None:
+                self._cache.set(user_id, user)
+        return user
+
+    def invalidate(self, user_id):
+        self._cache.delete(user_id)
+
+    def clear(self):
+        self._cache.clear()
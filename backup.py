@@ -0,0 +1,278 @@
+"""Online hot backups of instance/database.db.
+
+Snapshots are taken with sqlite3's backup API a few pages at a time, sleeping between
+steps so live readers and writers keep their latency. A write from another connection
+makes SQLite restart the copy from the first page, so after a few restarts the rest is
+copied in one pass; in WAL mode the whole copy is one read transaction that writers never
+wait on, so it is always done in one pass. Each snapshot is gzip-compressed
+and described by a JSON manifest holding its SHA-256; uploads can optionally be included
+as content-addressed blobs listed in the same manifest (unchanged files are stored once
+across snapshots).
+
+    python backup.py create [--uploads] [--keep 7] [--dest instance/backups]
+    python backup.py list
+    python backup.py verify <manifest.json>
+    python backup.py restore <manifest.json> [--db instance/database.db] [--uploads]
+"""
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+PAGES_PER_STEP = 256
+STEP_SLEEP = 0.02
+# restarts tolerated before the stepped copy gives up and copies in one pass
+MAX_RESTARTS = 3
+KEEP = 7
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'database.db')
+CHUNK = 1024 * 1024
+
+
+def _sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class _Restarted(Exception):
+    pass
+
+
+def _copy_db(db_path, target_path, pages=PAGES_PER_STEP, sleep=STEP_SLEEP, max_restarts=MAX_RESTARTS):
+    """Copy a live database into target_path.
+    In rollback-journal mode the copy is stepped: the source lock is released between steps,
+    so sleeping here lets app traffic through. Every write from another connection restarts
+    the copy, so under steady writes it falls back to one pass after max_restarts restarts,
+    making writers wait once instead of the backup never finishing."""
+    src = sqlite3.connect(db_path)
+    dst = sqlite3.connect(target_path)
+    seen = {'remaining': None, 'restarts': 0}
+
+    def progress(status, remaining, total):
+        # remaining only grows when SQLite has started over from the first page
+        if seen['remaining'] is not None and remaining > seen['remaining']:
+            seen['restarts'] += 1
+            if seen['restarts'] > max_restarts:
+                raise _Restarted()
+        seen['remaining'] = remaining
+        if remaining and sleep:
+            time.sleep(sleep)
+
+    try:
+        wal = src.execute('PRAGMA journal_mode').fetchone()[0].lower() == 'wal'
+        if not wal:
+            try:
+                src.backup(dst, pages=pages, progress=progress)
+                return
+            except _Restarted:
+                pass
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def _store_uploads(storage, dest_dir):
+    """Copy every upload into dest_dir/blobs/<sha256> and return {key: sha256}."""
+    blobs_dir = os.path.join(dest_dir, 'blobs')
+    os.makedirs(blobs_dir, exist_ok=True)
+    files = {}
+    for key in storage.keys():
+        tmp = tempfile.NamedTemporaryFile(dir=blobs_dir, delete=False)
+        h = hashlib.sha256()
+        try:
+            with storage.open(key) as src, tmp:
+                for chunk in iter(lambda: src.read(CHUNK), b''):
+                    h.update(chunk)
+                    tmp.write(chunk)
+            digest = h.hexdigest()
+            blob = os.path.join(blobs_dir, digest)
+            if os.path.exists(blob):
+                os.remove(tmp.name)
+            else:
+                os.replace(tmp.name, blob)
+        except Exception:
+            if os.path.exists(tmp.name):
+                os.remove(tmp.name)
+            raise
+        files[key] = digest
+    return files
+
+
+def create(db_path, dest_dir, storage=None, keep=KEEP, pages=PAGES_PER_STEP, sleep=STEP_SLEEP):
+    """Take a compressed, checksummed snapshot and apply retention. Returns the manifest path."""
+    os.makedirs(dest_dir, exist_ok=True)
+    name = time.strftime('snapshot-%Y%m%d-%H%M%S', time.gmtime())
+    started = time.time()
+    fd, raw = tempfile.mkstemp(dir=dest_dir, suffix='.db')
+    os.close(fd)
+    archive = os.path.join(dest_dir, name + '.db.gz')
+    try:
+        _copy_db(db_path, raw, pages=pages, sleep=sleep)
+        db_sha = _sha256_file(raw)
+        with open(raw, 'rb') as src, gzip.open(archive, 'wb', compresslevel=6) as out:
+            shutil.copyfileobj(src, out, CHUNK)
+        db_size = os.path.getsize(raw)
+    finally:
+        os.remove(raw)
+    manifest = {
+        'name': name,
+        'created_at': int(started),
+        'duration_seconds': round(time.time() - started, 3),
+        'database': {
+            'file': os.path.basename(archive),
+            'size': db_size,
+            'sha256': db_sha,
+            'archive_sha256': _sha256_file(archive),
+        },
+    }
+    if storage is not None:
+        manifest['uploads'] = _store_uploads(storage, dest_dir)
+    manifest_path = os.path.join(dest_dir, name + '.json')
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    prune(dest_dir, keep)
+    return manifest_path
+
+
+def list_snapshots(dest_dir):
+    """Return manifests in dest_dir, newest first."""
+    if not os.path.isdir(dest_dir):
+        return []
+    out = []
+    for fn in sorted(os.listdir(dest_dir), reverse=True):
+        if fn.startswith('snapshot-') and fn.endswith('.json'):
+            with open(os.path.join(dest_dir, fn), encoding='utf-8') as f:
+                out.append(json.load(f))
+    return out
+
+
+def prune(dest_dir, keep=KEEP):
+    """Delete all but the newest `keep` snapshots and any upload blobs they no longer reference."""
+    snapshots = list_snapshots(dest_dir)
+    for m in snapshots[keep:]:
+        for fn in (m['database']['file'], m['name'] + '.json'):
+            try:
+                os.remove(os.path.join(dest_dir, fn))
+            except FileNotFoundError:
+                pass
+    blobs_dir = os.path.join(dest_dir, 'blobs')
+    if os.path.isdir(blobs_dir):
+        live = set()
+        for m in snapshots[:keep]:
+            live.update(m.get('uploads', {}).values())
+        for fn in os.listdir(blobs_dir):
+            if fn not in live:
+                os.remove(os.path.join(blobs_dir, fn))
+
+
+def _extract(manifest_path, target_path):
+    """Decompress a snapshot's database to target_path, checking both checksums."""
+    dest_dir = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    archive = os.path.join(dest_dir, manifest['database']['file'])
+    if _sha256_file(archive) != manifest['database']['archive_sha256']:
+        raise ValueError(f'{archive}: archive checksum mismatch')
+    with gzip.open(archive, 'rb') as src, open(target_path, 'wb') as out:
+        shutil.copyfileobj(src, out, CHUNK)
+    if _sha256_file(target_path) != manifest['database']['sha256']:
+        raise ValueError(f'{archive}: database checksum mismatch')
+    return manifest, dest_dir
+
+
+def verify(manifest_path):
+    """Restore the snapshot into a scratch file and check it. Returns a list of problems (empty if ok)."""
+    problems = []
+    fd, scratch = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        try:
+            manifest, dest_dir = _extract(manifest_path, scratch)
+        except (OSError, ValueError) as e:
+            return [str(e)]
+        conn = sqlite3.connect(scratch)
+        try:
+            result = conn.execute('PRAGMA integrity_check').fetchone()[0]
+            if result != 'ok':
+                problems.append(f'integrity_check: {result}')
+        finally:
+            conn.close()
+        for key, digest in manifest.get('uploads', {}).items():
+            blob = os.path.join(dest_dir, 'blobs', digest)
+            if not os.path.exists(blob):
+                problems.append(f'{key}: missing blob {digest}')
+            elif _sha256_file(blob) != digest:
+                problems.append(f'{key}: blob checksum mismatch')
+    finally:
+        os.remove(scratch)
+    return problems
+
+
+def restore(manifest_path, db_path, storage=None):
+    """Verify a snapshot and copy it over db_path; optionally put uploads back.
+    The copy goes through the backup API rather than a file swap: it takes the write lock
+    on the live database, and SQLite discards its WAL or hot journal instead of replaying
+    writes made after the snapshot onto the restored file."""
+    problems = verify(manifest_path)
+    if problems:
+        raise ValueError('snapshot failed verification: ' + '; '.join(problems))
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(db_path)), suffix='.restore')
+    os.close(fd)
+    try:
+        manifest, dest_dir = _extract(manifest_path, tmp)
+        src = sqlite3.connect(tmp)
+        dst = sqlite3.connect(db_path)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+            src.close()
+    finally:
+        os.remove(tmp)
+    if storage is not None:
+        for key, digest in manifest.get('uploads', {}).items():
+            with open(os.path.join(dest_dir, 'blobs', digest), 'rb') as f:
+                storage.save(key, f)
+    return manifest
+
+
+def _arg(args, flag, default=None):
+    if flag in args and args.index(flag) + 1 < len(args):
+        return args[args.index(flag) + 1]
+    return default
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    cmd = args[0] if args else ''
+    dest = _arg(args, '--dest', os.environ.get('BACKUP_DIR', os.path.join(os.path.dirname(DB_PATH), 'backups')))
+    db = _arg(args, '--db', DB_PATH)
+    storage = None
+    if '--uploads' in args:
+        from app import create_app, get_storage
+        with create_app().app_context():
+            storage = get_storage()
+    if cmd == 'create':
+        path = create(db, dest, storage=storage, keep=int(_arg(args, '--keep', KEEP)))
+        print(f'Wrote {path}')
+    elif cmd == 'list':
+        for m in list_snapshots(dest):
+            print(f"{m['name']}  {m['database']['size']} bytes  uploads={len(m.get('uploads', {}))}")
+    elif cmd == 'verify' and len(args) > 1:
+        problems = verify(args[1])
+        print('\n'.join(problems) if problems else 'OK')
+        sys.exit(1 if problems else 0)
+    elif cmd == 'restore' and len(args) > 1:
+        restore(args[1], db, storage=storage)
+        print(f'Restored {args[1]} to {db}')
+    else:
+        print(__doc__)
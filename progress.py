@@ -0,0 +1,122 @@
+"""Per-user, per-book reading position.
+
+reader.js reports the current page on every flip. Writing each report would mean one
+SQLite write transaction per page turn, so reports are coalesced in memory (the latest
+position per user and book wins) and flushed periodically as a single batch of upserts.
+"""
+import atexit
+import threading
+import time
+
+FLUSH_INTERVAL = 5.0
+
+
+def ensure_schema(conn):
+    """Create reading_progress (and the book_pages index used to count pages) if missing."""
+    cur = conn.cursor()
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS reading_progress (
+        user_id INTEGER NOT NULL,
+        book_id INTEGER NOT NULL,
+        page_index INTEGER NOT NULL DEFAULT 0,
+        single_mode INTEGER NOT NULL DEFAULT 0,
+        updated_at INTEGER NOT NULL,
+        PRIMARY KEY (user_id, book_id)
+    )
+    ''')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_book_pages_book ON book_pages(book_id, page_number)')
+    conn.commit()
+
+
+class ProgressBuffer:
+    """Collects the latest position per (user_id, book_id) and writes them in batches."""
+
+    def __init__(self, connect, interval=FLUSH_INTERVAL):
+        self.connect = connect
+        self.interval = interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+
+    def record(self, user_id, book_id, page_index, single_mode):
+        with self._lock:
+            self._pending[(user_id, book_id)] = (int(page_index), 1 if single_mode else 0, int(time.time()))
+        self._start()
+
+    def get(self, user_id, book_id):
+        """Return {'page_index', 'single_mode'} for a user and book, or None if never recorded.
+        Unflushed positions take precedence over the stored row."""
+        with self._lock:
+            hit = self._pending.get((user_id, book_id))
+        if hit:
+            return {'page_index': hit[0], 'single_mode': bool(hit[1])}
+        conn = self.connect()
+        try:
+            row = conn.execute('SELECT page_index, single_mode FROM reading_progress WHERE user_id = ? AND book_id = ?',
+                               (user_id, book_id)).fetchone()
+        except Exception:
+            row = None
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        return {'page_index': row[0], 'single_mode': bool(row[1])}
+
+    def pending_for_user(self, user_id):
+        """Unflushed positions for one user: {book_id: {'page_index', 'single_mode'}}."""
+        with self._lock:
+            return {b: {'page_index': p, 'single_mode': bool(sm)}
+                    for (u, b), (p, sm, _) in self._pending.items() if u == user_id}
+
+    def flush(self):
+        """Write all pending positions in one transaction. Returns how many rows were written."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+            conn = self.connect()
+            try:
+                # another worker may hold a newer position; never move a row backwards in time
+                conn.executemany('''
+                    INSERT INTO reading_progress (user_id, book_id, page_index, single_mode, updated_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(user_id, book_id) DO UPDATE SET
+                        page_index = excluded.page_index,
+                        single_mode = excluded.single_mode,
+                        updated_at = excluded.updated_at
+                    WHERE excluded.updated_at >= reading_progress.updated_at
+                ''', [(u, b, p, s, t) for (u, b), (p, s, t) in batch.items()])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                # put the batch back unless a newer report arrived meanwhile
+                with self._lock:
+                    for key, value in batch.items():
+                        self._pending.setdefault(key, value)
+                raise
+            finally:
+                conn.close()
+            return len(batch)
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='progress-flush', daemon=True)
+            self._thread.start()
+        atexit.register(self._flush_quietly)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self._flush_quietly()
+
+    def _flush_quietly(self):
+        try:
+            self.flush()
+        except Exception:
+            pass
@@ -0,0 +1,242 @@
+"""Offline "similar books" job.
+
+Builds a user x book reading-time matrix from reading_sessions, computes item-item
+cosine similarity with scipy.sparse in batches and stores the top-K neighbours per book
+in book_similarities, which book_detail reads with a single indexed query.
+
+Run periodically (cron / systemd timer):
+
+    python recommend.py            # incremental from the last watermark
+    python recommend.py --full     # rebuild everything
+
+Requires numpy and scipy (pip install numpy scipy).
+"""
+import os
+import sqlite3
+import sys
+import time
+
+TOP_K = 8
+BATCH_SIZE = 2048
+# rows per read query / committed write. Outside WAL mode a long read keeps writers from
+# committing just like a long write does, so big scans are split into short queries
+CHUNK_ROWS = 50000
+# pause between committed chunks; without it the next chunk grabs the lock before a waiting
+# writer's busy handler wakes up, and the writer can starve
+CHUNK_PAUSE = 0.05
+# only sessions that ended at least this long ago are folded in: reading_stop stamps ended_at
+# before it commits, and may wait up to sqlite3's busy timeout (5 s) for the write lock
+SETTLE_SECONDS = 300
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'database.db')
+
+
+_READING_TABLE = '''
+    CREATE TABLE IF NOT EXISTS {name} (
+        user_id INTEGER NOT NULL,
+        book_id INTEGER NOT NULL,
+        seconds INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, book_id)
+    )
+    '''
+
+
+def ensure_schema(conn):
+    """Create the tables used by the job if they don't exist yet."""
+    cur = conn.cursor()
+    # per-user, per-book total reading time aggregated from closed sessions
+    cur.execute(_READING_TABLE.format(name='user_book_reading'))
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS book_similarities (
+        book_id INTEGER NOT NULL,
+        rank INTEGER NOT NULL,
+        similar_book_id INTEGER NOT NULL,
+        score REAL NOT NULL,
+        PRIMARY KEY (book_id, rank)
+    )
+    ''')
+    # books whose reading vectors changed but whose neighbours haven't been rewritten yet
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS recommend_pending (
+        book_id INTEGER PRIMARY KEY
+    )
+    ''')
+    # small key/value table so offline jobs can remember how far they got
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS job_state (
+        name TEXT PRIMARY KEY,
+        value INTEGER
+    )
+    ''')
+    # incremental runs scan reading_sessions by ended_at
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_reading_sessions_ended_at ON reading_sessions(ended_at)')
+    conn.commit()
+
+
+def _get_watermark(conn, name):
+    row = conn.execute('SELECT value FROM job_state WHERE name = ?', (name,)).fetchone()
+    return row[0] if row and row[0] is not None else 0
+
+
+def _set_watermark(conn, name, value):
+    conn.execute('INSERT INTO job_state (name, value) VALUES (?, ?) '
+                 'ON CONFLICT(name) DO UPDATE SET value = excluded.value', (name, value))
+
+
+def _session_totals(conn, since, until):
+    """Per (user_id, book_id) reading time of sessions closed in (since, until]. Read-only.
+    A full scan (since == 0) walks reading_sessions in id windows of CHUNK_ROWS."""
+    sql = '''
+        SELECT user_id, book_id, SUM(duration_seconds) AS secs
+        FROM reading_sessions
+        WHERE ended_at > ? AND ended_at <= ? AND duration_seconds > 0 {window}
+        GROUP BY user_id, book_id
+    '''
+    if since:
+        # incremental runs only see recent sessions, found through idx_reading_sessions_ended_at
+        return conn.execute(sql.format(window=''), (since, until)).fetchall()
+    max_id = conn.execute('SELECT MAX(id) FROM reading_sessions').fetchone()[0] or 0
+    totals = {}
+    for start in range(0, max_id, CHUNK_ROWS):
+        for user_id, book_id, secs in conn.execute(sql.format(window='AND id > ? AND id <= ?'),
+                                                   (since, until, start, start + CHUNK_ROWS)):
+            totals[(user_id, book_id)] = totals.get((user_id, book_id), 0) + secs
+    return [(u, b, secs) for (u, b), secs in totals.items()]
+
+
+def _accumulate_sessions(conn, rows):
+    """Fold session totals into user_book_reading. Returns the set of book ids whose
+    reading vectors changed. Does not commit."""
+    conn.executemany('''
+        INSERT INTO user_book_reading (user_id, book_id, seconds) VALUES (?, ?, ?)
+        ON CONFLICT(user_id, book_id) DO UPDATE SET seconds = seconds + excluded.seconds
+    ''', rows)
+    return {r[1] for r in rows}
+
+
+def _rebuild_reading(conn, rows):
+    """Replace user_book_reading with rows. The new table is filled on the side in small
+    committed chunks and swapped in at the end, so app writes only ever wait for one chunk.
+    The swap itself is left uncommitted for the caller."""
+    # inserting in primary key order keeps every chunk an append to the b-tree
+    rows = sorted(rows)
+    conn.execute('DROP TABLE IF EXISTS user_book_reading_rebuild')
+    conn.execute(_READING_TABLE.format(name='user_book_reading_rebuild'))
+    conn.commit()
+    for start in range(0, len(rows), CHUNK_ROWS):
+        conn.executemany('INSERT INTO user_book_reading_rebuild (user_id, book_id, seconds) VALUES (?, ?, ?)',
+                         rows[start:start + CHUNK_ROWS])
+        conn.commit()
+        time.sleep(CHUNK_PAUSE)
+    conn.execute('DROP TABLE user_book_reading')
+    conn.execute('ALTER TABLE user_book_reading_rebuild RENAME TO user_book_reading')
+    return {r[1] for r in rows}
+
+
+def _load_matrix(conn):
+    """Return (X, book_ids) where X is a CSC users x books matrix of log-scaled reading time,
+    with each book column L2-normalised so X.T @ X is cosine similarity."""
+    import numpy as np
+    from scipy import sparse
+
+    data, last = [], 0
+    while True:
+        rows = conn.execute('SELECT rowid, user_id, book_id, seconds FROM user_book_reading '
+                            'WHERE rowid > ? AND seconds > 0 ORDER BY rowid LIMIT ?', (last, CHUNK_ROWS)).fetchall()
+        if not rows:
+            break
+        last = rows[-1][0]
+        data.extend(r[1:] for r in rows)
+    if not data:
+        return None, np.array([], dtype=np.int64)
+    arr = np.array(data, dtype=np.int64)
+    user_ids, user_idx = np.unique(arr[:, 0], return_inverse=True)
+    book_ids, book_idx = np.unique(arr[:, 1], return_inverse=True)
+    # damp very long sessions so a single binge reader doesn't dominate
+    weights = np.log1p(arr[:, 2].astype(np.float64))
+    X = sparse.csc_matrix((weights, (user_idx, book_idx)), shape=(len(user_ids), len(book_ids)))
+    norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=0)).ravel())
+    norms[norms == 0] = 1.0
+    X = X @ sparse.diags(1.0 / norms)
+    return X.tocsc(), book_ids
+
+
+def _top_k(X, book_ids, cols, k):
+    """Yield (book_id, [(similar_book_id, score), ...]) for the given column indices,
+    computing one BATCH_SIZE slice of the similarity matrix at a time. The slice stays
+    sparse, so memory follows the number of co-read pairs rather than books x batch."""
+    import numpy as np
+
+    XT = X.T.tocsr()
+    for start in range(0, len(cols), BATCH_SIZE):
+        batch = cols[start:start + BATCH_SIZE]
+        S = (XT @ X[:, batch]).tocsc()  # books x batch
+        for j, c in enumerate(batch):
+            lo, hi = S.indptr[j], S.indptr[j + 1]
+            rows, scores = S.indices[lo:hi], S.data[lo:hi]
+            # a book isn't its own neighbour
+            keep = (rows != c) & (scores > 0)
+            rows, scores = rows[keep], scores[keep]
+            if len(scores) > k:
+                part = np.argpartition(-scores, k - 1)[:k]
+                rows, scores = rows[part], scores[part]
+            order = np.argsort(-scores)
+            yield int(book_ids[c]), [(int(book_ids[i]), float(s)) for i, s in zip(rows[order], scores[order])]
+
+
+def run(db_path=None, full=False, k=TOP_K):
+    """Run the job; returns the number of books whose neighbours were recomputed.
+    The database is only written in two short transactions, before and after the
+    numpy/scipy work, so app writes are never held up by the computation."""
+    import numpy as np
+
+    conn = sqlite3.connect(db_path or DB_PATH)
+    try:
+        ensure_schema(conn)
+        until = int(time.time()) - SETTLE_SECONDS
+        # 1) fold newly closed sessions in and remember which books they touched
+        if full:
+            touched = _rebuild_reading(conn, _session_totals(conn, 0, until))
+        else:
+            touched = _accumulate_sessions(conn, _session_totals(conn, _get_watermark(conn, 'recommend'), until))
+        conn.executemany('INSERT OR IGNORE INTO recommend_pending (book_id) VALUES (?)', [(b,) for b in touched])
+        _set_watermark(conn, 'recommend', until)
+        conn.commit()
+
+        # 2) compute outside any transaction
+        pending = [r[0] for r in conn.execute('SELECT book_id FROM recommend_pending')]
+        X, book_ids = _load_matrix(conn)
+        cols, results = [], []
+        if X is not None and full:
+            cols = np.arange(len(book_ids))
+        elif X is not None and pending:
+            # only books co-read with a changed book can see their neighbour lists change
+            changed = np.flatnonzero(np.isin(book_ids, pending))
+            readers = np.unique(X[:, changed].tocoo().row)
+            cols = np.unique(X[readers, :].tocoo().col)
+        if len(cols):
+            results = list(_top_k(X, book_ids, cols, k))
+
+        # 3) swap the neighbour lists in one short write transaction
+        cur = conn.cursor()
+        if full:
+            cur.execute('DELETE FROM book_similarities')
+        for book_id, neighbours in results:
+            if not full:
+                cur.execute('DELETE FROM book_similarities WHERE book_id = ?', (book_id,))
+            cur.executemany('INSERT INTO book_similarities (book_id, rank, similar_book_id, score) VALUES (?, ?, ?, ?)',
+                            [(book_id, rank, other, score) for rank, (other, score) in enumerate(neighbours, 1)])
+        cur.executemany('DELETE FROM recommend_pending WHERE book_id = ?', [(b,) for b in pending])
+        conn.commit()
+        return len(results)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    full = '--full' in sys.argv[1:]
+    started = time.time()
+    n = run(full=full)
+    print(f'Recomputed similar books for {n} books in {time.time() - started:.2f}s')
@@ -0,0 +1,107 @@
+// Virtualized admin page grid: pages are fetched in chunks from pages.json and only the
+// rows in (or near) the viewport are in the DOM, so books with thousands of pages stay light.
+(function(){
+  const grid = document.getElementById('pages-grid')
+  if(!grid) return
+  const inner = document.getElementById('pages-grid-inner')
+  const bookId = grid.dataset.bookId
+  const selectedEl = document.getElementById('pages-selected')
+  const moveTo = document.getElementById('pages-move-to')
+  const TILE_W = 176, TILE_H = 270, CHUNK = 100, OVERSCAN = 2
+
+  let total = parseInt(grid.dataset.total, 10) || 0
+  let chunks = {}          // chunk index -> array of pages (or a pending Promise)
+  let generation = 0       // bumped when chunks are reset; responses from older generations are dropped
+  const selected = new Set()
+
+  function columns(){ return Math.max(1, Math.floor(grid.clientWidth / TILE_W)) }
+
+  function loadChunk(c){
+    if(chunks[c]) return
+    const gen = generation
+    chunks[c] = fetch(`/admin/books/${bookId}/pages.json?offset=${c * CHUNK}&limit=${CHUNK}`, {credentials: 'same-origin'})
+      .then(r=>r.json()).then(j=>{
+        // a bulk action reset the grid while this was in flight; its rows are stale
+        if(gen !== generation) return
+        chunks[c] = j.pages || []
+        if(j.total !== total){ total = j.total; document.getElementById('pages-total').textContent = total }
+        render()
+      }).catch(()=>{ if(gen === generation) delete chunks[c] })
+  }
+
+  function pageAt(i){
+    const c = Math.floor(i / CHUNK)
+    const chunk = chunks[c]
+    if(!Array.isArray(chunk)){ loadChunk(c); return null }
+    return chunk[i - c * CHUNK] || null
+  }
+
+  function tile(i, p, cols){
+    const el = document.createElement('div')
+    el.style.cssText = `position:absolute;left:${(i % cols) * TILE_W}px;top:${Math.floor(i / cols) * TILE_H}px;width:${TILE_W - 12}px;height:${TILE_H - 12}px;margin:6px;border:1px solid #eee;border-radius:6px;padding:6px;box-sizing:border-box;display:flex;flex-direction:column;gap:4px`
+    if(!p){ el.style.background = '#f9fafb'; return el }
+    if(selected.has(p.id)) el.style.outline = '2px solid var(--accent,#2563eb)'
+    const label = document.createElement('label')
+    label.style.cssText = 'display:flex;gap:4px;align-items:center;font-size:.85rem;overflow:hidden;white-space:nowrap'
+    const cb = document.createElement('input')
+    cb.type = 'checkbox'
+    cb.checked = selected.has(p.id)
+    cb.addEventListener('change', ()=>{ cb.checked ? selected.add(p.id) : selected.delete(p.id); updateSelection(); render() })
+    label.appendChild(cb)
+    label.appendChild(document.createTextNode(`#${p.page_number}`))
+    label.title = p.filename
+    const img = document.createElement('img')
+    img.loading = 'lazy'
+    img.decoding = 'async'
+    img.src = p.thumb
+    img.alt = `page ${p.page_number}`
+    img.style.cssText = 'width:100%;height:210px;object-fit:contain;background:#f3f4f6'
+    el.appendChild(label)
+    el.appendChild(img)
+    return el
+  }
+
+  function render(){
+    const cols = columns()
+    const rows = Math.ceil(total / cols)
+    inner.style.height = (rows * TILE_H) + 'px'
+    const first = Math.max(0, Math.floor(grid.scrollTop / TILE_H) - OVERSCAN)
+    const last = Math.min(rows, Math.ceil((grid.scrollTop + grid.clientHeight) / TILE_H) + OVERSCAN)
+    const frag = document.createDocumentFragment()
+    for(let i = first * cols; i < Math.min(total, last * cols); i++) frag.appendChild(tile(i, pageAt(i), cols))
+    inner.replaceChildren(frag)
+  }
+
+  function updateSelection(){ selectedEl.textContent = selected.size }
+
+  function bulk(body){
+    return fetch(`/admin/books/${bookId}/pages/bulk`, {
+      method: 'POST',
+      headers: {'Content-Type': 'application/json'},
+      credentials: 'same-origin',
+      body: JSON.stringify(Object.assign({page_ids: Array.from(selected)}, body))
+    }).then(r=>r.json()).then(j=>{
+      if(j.error){ alert(j.error); return }
+      selected.clear(); updateSelection()
+      generation++
+      chunks = {}
+      render()
+    })
+  }
+
+  document.getElementById('pages-clear').addEventListener('click', ()=>{ selected.clear(); updateSelection(); render() })
+  document.getElementById('pages-delete').addEventListener('click', ()=>{
+    if(!selected.size || !confirm(`Delete ${selected.size} page(s)?`)) return
+    bulk({action: 'delete'})
+  })
+  document.getElementById('pages-move').addEventListener('click', ()=>{
+    if(!selected.size) return
+    bulk({action: 'move', position: parseInt(moveTo.value, 10) || 1})
+  })
+
+  let scheduled = false
+  function schedule(){ if(scheduled) return; scheduled = true; requestAnimationFrame(()=>{ scheduled = false; render() }) }
+  grid.addEventListener('scroll', schedule)
+  window.addEventListener('resize', schedule)
+  render()
+})()
@@ -9,9 +9,12 @@ document.addEventListener('DOMContentLoaded', function(){
   const toggleSingle = document.getElementById('toggleSingle')
   const fullscreenBtn = document.getElementById('fullscreenBtn')
 
-  let pageIndex = 0
-  let singlePageMode = false
+  const state = window.READER_STATE || {}
+  let pageIndex = Math.max(0, Math.min(state.start || 0, Math.max(0, pages.length - 1)))
+  let singlePageMode = !!state.single
   let animating = false
+  // the position we opened at is already saved; only report changes from it
+  let lastReported = pageIndex + ':' + singlePageMode
   let _prevSingleMode = null
 
   function clampIndex(i){
@@ -58,6 +61,38 @@ document.addEventListener('DOMContentLoaded', function(){
 
     if(prev) prev.disabled = (pageIndex <= 0)
     if(next) next.disabled = (pageIndex + (singlePageMode ? 1 : 2) > pages.length - 1)
+
+    prefetch()
+    reportProgress()
+  }
+
+  // warm the browser cache for the spreads either side of the current one
+  const prefetched = new Set()
+  function prefetch(){
+    const step = singlePageMode ? 1 : 2
+    for(let i = Math.max(0, pageIndex - step); i < Math.min(pages.length, pageIndex + 2 * step); i++){
+      if(prefetched.has(i)) continue
+      prefetched.add(i)
+      const img = new Image()
+      img.src = pages[i]
+    }
+  }
+
+  // tell the server where we are; it coalesces these and writes them in batches
+  function reportProgress(){
+    if(!state.track || !state.bookId) return
+    const key = pageIndex + ':' + singlePageMode
+    if(key === lastReported) return
+    lastReported = key
+    try{
+      fetch('/reading/progress', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        credentials: 'same-origin',
+        body: JSON.stringify({book_id: state.bookId, page: pageIndex, single: singlePageMode}),
+        keepalive: true
+      }).catch(()=>{})
+    }catch(e){}
   }
 
   function animateFlip(direction, updateFn){
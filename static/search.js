@@ -4,12 +4,14 @@
   const box = document.getElementById('nav-suggestions')
   if(!input || !box) return
   let timer = null
+  // only the latest request counts: starting a new one aborts whatever is still in flight
+  let inflight = null
   function hide(){ box.style.display='none'; box.innerHTML = '' }
   function render(items){
     if(!items || items.length===0){ hide(); return }
     box.innerHTML = items.map(i=>`
       <a href="${location.origin}/books/${i.id}" style="display:flex;gap:8px;padding:8px 10px;align-items:center;text-decoration:none;color:#111">
-        <div style="width:40px;height:56px;flex:0 0 40px;background:#f3f4f6;border-radius:4px;overflow:hidden">${i.image?`<img src='/static/uploads/${i.image}' style='width:100%;height:100%;object-fit:cover'/>`:''}</div>
+        <div style="width:40px;height:56px;flex:0 0 40px;background:#f3f4f6;border-radius:4px;overflow:hidden">${i.image?`<img src='${i.image_url}' style='width:100%;height:100%;object-fit:cover'/>`:''}</div>
         <div style='flex:1'><div style='font-weight:600'>${i.title}</div><div style='color:#6b7280;font-size:.9rem'>${i.author||''}</div></div>
       </a>
     `).join('')
@@ -18,10 +20,20 @@
   input.addEventListener('input', function(){
     const q = input.value.trim()
     if(timer) clearTimeout(timer)
+    if(inflight){ inflight.abort(); inflight = null }
     if(!q){ hide(); return }
     timer = setTimeout(()=>{
-      fetch(`/search/suggest?q=${encodeURIComponent(q)}`)
-        .then(r=>r.json()).then(j=>{ render(j.suggestions || []) }).catch(()=>{ hide() })
+      const ctrl = new AbortController()
+      inflight = ctrl
+      fetch(`/search/suggest?q=${encodeURIComponent(q)}`, {signal: ctrl.signal})
+        .then(r=>{
+          // throttled (429): keep the current suggestions, the next keystroke will retry
+          if(r.status === 429) return null
+          return r.json()
+        })
+        .then(j=>{ if(j && inflight === ctrl) render(j.suggestions || []) })
+        .catch(e=>{ if(e.name !== 'AbortError') hide() })
+        .finally(()=>{ if(inflight === ctrl) inflight = null })
     }, 180)
   })
   // Submit on Enter -> go to full search page
@@ -0,0 +1,191 @@
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+
+class LocalStorage:
+    """Store uploads on local disk under static/uploads (the original layout).
+    Keys are paths relative to the uploads folder, e.g. '10/001_page.png' or 'cover.jpg'."""
+
+    def __init__(self, root, url_prefix='/static/uploads'):
+        self.root = root
+        self.url_prefix = url_prefix.rstrip('/')
+
+    def _path(self, key):
+        # keys never escape the uploads root
+        parts = [p for p in key.replace('\\', '/').split('/') if p not in ('', '.', '..')]
+        return os.path.join(self.root, *parts)
+
+    def save(self, key, fileobj):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if hasattr(fileobj, 'save'):
+            # werkzeug FileStorage streams to disk in chunks
+            fileobj.save(path)
+        else:
+            with open(path, 'wb') as out:
+                shutil.copyfileobj(fileobj, out)
+        return key
+
+    def delete(self, key):
+        path = self._path(key)
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+        except Exception:
+            pass
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def open(self, key):
+        return open(self._path(key), 'rb')
+
+    def url(self, key):
+        return f"{self.url_prefix}/{quote(key, safe='/')}"
+
+    def keys(self, prefix=''):
+        """Yield every stored key (optionally under a prefix) in sorted order."""
+        base = self._path(prefix) if prefix else self.root
+        if not os.path.isdir(base):
+            return
+        for dirpath, dirnames, filenames in os.walk(base):
+            dirnames.sort()
+            for fn in sorted(filenames):
+                full = os.path.join(dirpath, fn)
+                yield os.path.relpath(full, self.root).replace(os.sep, '/')
+
+    def save_many(self, items, max_workers=4):
+        """Save (key, fileobj) pairs. Local disk is fast enough to do this sequentially."""
+        return [self.save(key, f) for key, f in items]
+
+
+class S3Storage:
+    """Store uploads in an S3-compatible bucket so several app nodes share the same media.
+    Works against AWS S3 or any local stand-in (MinIO, LocalStack) via endpoint_url.
+    Reads go through a small local disk cache so thumbnails/pages aren't re-fetched on every use."""
+
+    # objects larger than this are uploaded in parts
+    MULTIPART_THRESHOLD = 8 * 1024 * 1024
+    MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+
+    def __init__(self, bucket, prefix='uploads', endpoint_url=None, public_url=None,
+                 cache_dir=None, region_name=None):
+        try:
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+        except ImportError:
+            raise RuntimeError('S3 storage backend requires boto3 (pip install boto3)')
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region_name)
+        self.transfer_config = TransferConfig(
+            multipart_threshold=self.MULTIPART_THRESHOLD,
+            multipart_chunksize=self.MULTIPART_CHUNKSIZE,
+        )
+        if public_url:
+            self.public_url = public_url.rstrip('/')
+        elif endpoint_url:
+            self.public_url = f"{endpoint_url.rstrip('/')}/{bucket}"
+        else:
+            self.public_url = f"https://{bucket}.s3.amazonaws.com"
+        self.cache = LocalStorage(cache_dir) if cache_dir else None
+
+    def _object_key(self, key):
+        key = key.lstrip('/')
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def save(self, key, fileobj):
+        stream = getattr(fileobj, 'stream', fileobj)
+        extra = {}
+        mimetype = getattr(fileobj, 'mimetype', None)
+        if mimetype:
+            extra['ContentType'] = mimetype
+        # upload_fileobj streams the body and switches to multipart above the threshold
+        self.client.upload_fileobj(stream, self.bucket, self._object_key(key),
+                                   ExtraArgs=extra or None, Config=self.transfer_config)
+        if self.cache:
+            self.cache.delete(key)
+        return key
+
+    def delete(self, key):
+        try:
+            self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+        except Exception:
+            pass
+        if self.cache:
+            self.cache.delete(key)
+
+    def exists(self, key):
+        if self.cache and self.cache.exists(key):
+            return True
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+            return True
+        except Exception:
+            return False
+
+    def open(self, key):
+        """Return a readable file object, fetching into the local cache first if configured."""
+        if self.cache is None:
+            obj = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+            return obj['Body']
+        if not self.cache.exists(key):
+            path = self.cache._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # each miss downloads to its own .part file, so concurrent misses don't wait on
+            # each other; two racing downloads of one key both end in the same complete file
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+            os.close(fd)
+            try:
+                self.client.download_file(self.bucket, self._object_key(key), tmp,
+                                          Config=self.transfer_config)
+                os.replace(tmp, path)
+            except Exception:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+        return self.cache.open(key)
+
+    def url(self, key):
+        return f"{self.public_url}/{quote(self._object_key(key), safe='/')}"
+
+    def keys(self, prefix=''):
+        paginator = self.client.get_paginator('list_objects_v2')
+        base = self._object_key(prefix) if prefix else (self.prefix + '/' if self.prefix else '')
+        strip = len(self.prefix) + 1 if self.prefix else 0
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=base):
+            for obj in page.get('Contents', []):
+                yield obj['Key'][strip:]
+
+    def save_many(self, items, max_workers=4):
+        """Upload (key, fileobj) pairs concurrently; returns keys in input order."""
+        items = list(items)
+        if len(items) <= 1:
+            return [self.save(key, f) for key, f in items]
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(lambda kv: self.save(*kv), items))
+
+
+def create_storage(app):
+    """Build the storage backend from environment settings.
+    STORAGE_BACKEND=local (default) keeps files in static/uploads.
+    STORAGE_BACKEND=s3 uses S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL, S3_PUBLIC_URL, S3_REGION
+    and caches reads under instance/storage_cache."""
+    backend = os.environ.get('STORAGE_BACKEND', 'local').lower()
+    if backend == 's3':
+        bucket = os.environ.get('S3_BUCKET')
+        if not bucket:
+            raise RuntimeError('STORAGE_BACKEND=s3 requires S3_BUCKET')
+        return S3Storage(
+            bucket,
+            prefix=os.environ.get('S3_PREFIX', 'uploads'),
+            endpoint_url=os.environ.get('S3_ENDPOINT_URL') or None,
+            public_url=os.environ.get('S3_PUBLIC_URL') or None,
+            cache_dir=os.path.join(app.instance_path, 'storage_cache'),
+            region_name=os.environ.get('S3_REGION') or None,
+        )
+    return LocalStorage(os.path.join(app.static_folder, 'uploads'),
+                        url_prefix=(app.static_url_path or '/static') + '/uploads')
@@ -0,0 +1,51 @@
+"""Small JPEG thumbnails of book pages for the admin page grid.
+
+Thumbnails are stored next to the originals through the storage backend under
+thumbs/<book_id>/<filename>.jpg. They are made when pages are uploaded and, for pages
+uploaded before this existed, on first request. Requires Pillow (in requirements.txt);
+without it callers fall back to the original image.
+"""
+import io
+
+THUMB_SIZE = (160, 220)
+THUMB_QUALITY = 70
+
+
+def thumb_key(book_id, filename):
+    return f'thumbs/{book_id}/{filename}.jpg'
+
+
+def available():
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def make_thumbnail(storage, book_id, filename):
+    """Render and store the thumbnail for one page. Returns its key, or None if it can't be made."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    try:
+        with storage.open(f'{book_id}/{filename}') as src:
+            img = Image.open(src)
+            # decode at a reduced size where the format supports it (JPEG), then resize
+            img.draft('RGB', (THUMB_SIZE[0] * 2, THUMB_SIZE[1] * 2))
+            img = img.convert('RGB')
+            img.thumbnail(THUMB_SIZE)
+        buf = io.BytesIO()
+        img.save(buf, 'JPEG', quality=THUMB_QUALITY, optimize=True)
+        buf.seek(0)
+    except (OSError, ValueError):
+        # missing or unreadable original
+        return None
+    key = thumb_key(book_id, filename)
+    storage.save(key, buf)
+    return key
+
+
+def delete_thumbnail(storage, book_id, filename):
+    storage.delete(thumb_key(book_id, filename))